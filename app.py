@@ -1,36 +1,117 @@
-from flask import Flask, request, jsonify, render_template
-from flask_cors import CORS
+from quart import Quart, Response, request, jsonify, render_template
+from quart.json.provider import JSONProvider
+from quart_cors import cors
+import orjson
+import tiktoken
 from dotenv import load_dotenv
+import asyncio
 import os
-import openai
 import json
-from neon_db import get_schema, execute_query, validate_sql as validate_neon_sql
+import re
+from openai import AsyncOpenAI, APIConnectionError, RateLimitError
+from tenacity import (
+    retry,
+    retry_if_exception_type,
+    stop_after_attempt,
+    wait_random_exponential,
+)
+from backends import get_backend
+from logging_setup import get_logger
+
+log = get_logger(__name__)
 
 # Load environment variables
 load_dotenv()
 
-# Initialize Flask app
-app = Flask(__name__)
-CORS(app)
+class ORJSONProvider(JSONProvider):
+    """JSON provider backed by orjson.
+
+    orjson serializes in C and handles datetime/UUID natively, so large
+    result sets encode several times faster than the default encoder;
+    anything else non-JSON falls back to str().
+    """
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=str).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+# Initialize Quart app. Quart runs every request on one long-lived event
+# loop, which the shared AsyncOpenAI client and the asyncpg pool rely on
+# (under Flask async views each request got its own short-lived loop)
+app = Quart(__name__)
+app.json = ORJSONProvider(app)
+app = cors(app)
 
 # OpenAI configuration
-openai.api_key = os.getenv('OPENAI_API_KEY')
-if not openai.api_key:
+if not os.getenv('OPENAI_API_KEY'):
     raise ValueError("OPENAI_API_KEY not found in environment variables")
 
-# Verify Neon DB connection
-if not os.getenv('NEON_DB_URL'):
+# Single async client shared across requests (avoids per-request TLS handshakes
+# and lets the worker keep many OpenAI calls in flight concurrently)
+openai_client = AsyncOpenAI(api_key=os.getenv('OPENAI_API_KEY'))
+
+# Cap concurrent OpenAI calls below the account's rate limits. An
+# asyncio.Semaphore is only sound because Quart runs every request on the
+# same long-lived loop; waiters parked on one loop are never woken by a
+# release on another
+openai_semaphore = asyncio.Semaphore(int(os.getenv('OPENAI_MAX_INFLIGHT', '8')))
+
+# Ride out transient 429s/connection errors with jittered exponential
+# backoff instead of surfacing them as 500s; jitter avoids a thundering
+# herd when many requests retry after a rate-limit recovery
+openai_retry = retry(
+    stop=stop_after_attempt(5),
+    wait=wait_random_exponential(min=0.5, max=10),
+    retry=retry_if_exception_type((RateLimitError, APIConnectionError)),
+    reraise=True,
+)
+
+@openai_retry
+async def _chat_completion_request(**kwargs):
+    return await openai_client.chat.completions.create(**kwargs)
+
+@openai_retry
+async def _embedding_request(**kwargs):
+    return await openai_client.embeddings.create(**kwargs)
+
+async def create_chat_completion(**kwargs):
+    async with openai_semaphore:
+        return await _chat_completion_request(**kwargs)
+
+async def create_embedding(**kwargs):
+    async with openai_semaphore:
+        return await _embedding_request(**kwargs)
+
+# Select the database backend (neon or sqlite)
+BACKEND_NAME = os.getenv('BACKEND', 'neon')
+if BACKEND_NAME == 'neon' and not os.getenv('NEON_DB_URL'):
     raise ValueError("NEON_DB_URL not found in environment variables")
+backend = get_backend(BACKEND_NAME)
 
 # Get database schema for context
 def get_database_schema():
-    return get_schema()
+    return backend.get_schema()
+
+# Validate SQL query using the backend's validation
+def validate_sql(query, allow_stale=False):
+    return backend.validate(query, allow_stale=allow_stale)
+
+# Token budget for the result sample in the summary prompt; decode latency
+# scales with prompt size, so cap by tokens rather than a fixed row count
+SUMMARY_PROMPT_TOKEN_BUDGET = 1500
 
-# Validate SQL query using Neon's validation
-def validate_sql(query):
-    return validate_neon_sql(query)
+_summary_encoder = None
 
-def generate_natural_language_summary(query, results):
+def get_summary_encoder():
+    """Tokenizer for prompt budgeting, built once (tiktoken init is not free)"""
+    global _summary_encoder
+    if _summary_encoder is None:
+        _summary_encoder = tiktoken.encoding_for_model("gpt-3.5-turbo")
+    return _summary_encoder
+
+async def generate_natural_language_summary(query, results):
     """Generate a natural language summary of query results"""
     if not results:
         return "No results found for your query."
@@ -42,30 +123,34 @@ def generate_natural_language_summary(query, results):
     # Count the number of results
     result_count = len(results)
     
-    # Prepare data for the prompt (handle non-serializable types)
-    def safe_serialize(obj):
-        try:
-            if hasattr(obj, 'hex'):  # Handle UUID
-                return str(obj)
-            return str(obj)  # Fallback to string representation
-        except:
-            return "[complex data]"
-    
-    # Create a safe version of results for the prompt
-    safe_results = []
-    for row in results[:5]:  # Only use first 5 rows for the prompt
-        safe_row = {}
-        for k, v in row.items():
-            try:
-                # Skip vector and binary data from the prompt
-                if 'vector' in str(k).lower() or 'embedding' in str(k).lower():
-                    continue
-                safe_row[k] = safe_serialize(v)
-            except:
-                continue
-        safe_results.append(safe_row)
+    # Vector/embedding columns are schema-intrinsic, so decide which to
+    # skip once per result set instead of re-checking every cell
+    skip_columns = {
+        c for c in columns
+        if 'vector' in str(c).lower() or 'embedding' in str(c).lower()
+    }
+
+    # Sample rows into the prompt until the token budget is spent, so wide
+    # tables contribute few rows and narrow tables contribute many; orjson
+    # handles datetime/UUID natively so no per-value conversion
+    encoder = get_summary_encoder()
+    sample_lines = []
+    used_tokens = 0
+    for row in results:
+        serialized = orjson.dumps(
+            {k: v for k, v in row.items() if k not in skip_columns},
+            default=str
+        ).decode()
+        row_tokens = len(encoder.encode(serialized))
+        if sample_lines and used_tokens + row_tokens > SUMMARY_PROMPT_TOKEN_BUDGET:
+            break
+        sample_lines.append(serialized)
+        used_tokens += row_tokens
+        if used_tokens > SUMMARY_PROMPT_TOKEN_BUDGET:
+            break
     
     # Create a prompt for the LLM to generate a summary
+    sample_json = '[' + ',\n     '.join(sample_lines) + ']'
     prompt = f"""
     You are a data analyst. Given the following query and its results, provide a concise, 
     natural language summary of what the data shows. Be specific about the numbers and 
@@ -73,13 +158,12 @@ def generate_natural_language_summary(query, results):
     
     Query: {query}
     
-    Results (showing {len(safe_results)} of {result_count} rows):
-    {json.dumps(safe_results, indent=2, default=str)}
+    Results (showing {len(sample_lines)} of {result_count} rows):
+    {sample_json}
     """
     
     try:
-        client = openai.OpenAI()
-        response = client.chat.completions.create(
+        response = await create_chat_completion(
             model="gpt-3.5-turbo",
             messages=[
                 {"role": "system", "content": "You are a helpful data analyst that explains query results in clear, concise natural language. Focus on the key insights and patterns in the data."},
@@ -91,76 +175,338 @@ def generate_natural_language_summary(query, results):
         
         return response.choices[0].message.content.strip()
     except Exception as e:
-        print(f"Error generating summary: {str(e)}")
+        log.error(f"Error generating summary: {str(e)}")
         # Fallback to a simple summary if LLM call fails
         return f"Found {result_count} results with columns: {', '.join(str(col) for col in columns)}."
 
-# Generate SQL from natural language
-def generate_sql(natural_language):
-    schema = get_database_schema()
-    
-    prompt = f"""
-    You are a SQL expert. Given the following database schema:
-    {json.dumps(schema, indent=2)}
-    
-    Convert the following natural language query into a SQL query:
-    "{natural_language}"
-    
-    Return ONLY the SQL query, nothing else. The query should be compatible with PostgreSQL.
-    """
-    
+async def embed_query(natural_language):
+    """Embed a natural language query for semantic cache lookups"""
+    import semantic_cache
+    response = await create_embedding(
+        model=semantic_cache.EMBEDDING_MODEL,
+        input=natural_language
+    )
+    return response.data[0].embedding
+
+async def queries_are_equivalent(query_a, query_b):
+    """Ask the LLM whether two natural language queries mean the same thing"""
     try:
-        client = openai.OpenAI()
-        response = client.chat.completions.create(
+        response = await create_chat_completion(
             model="gpt-3.5-turbo",
             messages=[
-                {"role": "system", "content": "You are a helpful assistant that converts natural language to SQL queries."},
-                {"role": "user", "content": prompt}
+                {"role": "system", "content": "You decide whether two natural language database questions ask for the same result. Answer with only YES or NO."},
+                {"role": "user", "content": f"Question 1: {query_a}\nQuestion 2: {query_b}"}
             ],
-            temperature=0.3,
-            max_tokens=500
+            temperature=0,
+            max_tokens=1
         )
-        
-        sql_query = response.choices[0].message.content.strip()
-        # Clean up the SQL query (remove code blocks if present)
-        if sql_query.startswith('```sql'):
-            sql_query = sql_query[6:]
-        if sql_query.endswith('```'):
-            sql_query = sql_query[:-3]
-        
-        return sql_query.strip()
+        return response.choices[0].message.content.strip().upper().startswith('YES')
     except Exception as e:
+        log.error(f"Error checking query equivalence: {str(e)}")
+        return False
+
+async def check_semantic_cache(natural_language):
+    """Look up a semantically equivalent cached query.
+
+    Returns (embedding, cached_entry). The embedding is reused to store the
+    result after a cache miss. High-confidence hits are returned directly;
+    mid-confidence hits are confirmed with an LLM equivalence check.
+    The cache lives in pgvector, so it is only available on the Neon backend.
+    """
+    if backend.name != 'neon':
+        return None, None
+    import semantic_cache
+
+    try:
+        embedding = await embed_query(natural_language)
+    except Exception as e:
+        log.error(f"Error embedding query: {str(e)}")
+        return None, None
+
+    try:
+        # The cache speaks sync SQLAlchemy, so keep its round-trip off the
+        # event loop
+        hit = await asyncio.to_thread(semantic_cache.lookup, embedding)
+    except Exception as e:
+        log.error(f"Error querying semantic cache: {str(e)}")
+        return embedding, None
+
+    if hit is None:
+        return embedding, None
+    if hit['similarity'] >= semantic_cache.HIGH_CONFIDENCE:
+        return embedding, hit
+    if await queries_are_equivalent(natural_language, hit['nl_query']):
+        return embedding, hit
+    return embedding, None
+
+# SQL dialect named in the generation prompt, per backend
+SQL_DIALECT_NAME = 'PostgreSQL' if BACKEND_NAME == 'neon' else 'SQLite'
+
+_TOKEN_RE = re.compile(r'[^a-z0-9]+')
+
+def _name_tokens(*names):
+    """Lowercase word tokens (with naive singulars) for synonym matching"""
+    tokens = set()
+    for name in names:
+        for part in _TOKEN_RE.split(str(name).lower()):
+            if part:
+                tokens.add(part)
+                if part.endswith('s'):
+                    tokens.add(part[:-1])
+    return tokens
+
+def select_relevant_tables(natural_language, schema):
+    """Pick the tables a question is likely about, plus their FK neighbors.
+
+    Tables match when the question mentions their name or one of their
+    column names (singular or plural). Returns None when nothing matches
+    so the caller falls back to the full schema.
+    """
+    question_tokens = _name_tokens(natural_language)
+    matched = {
+        table for table, columns in schema.items()
+        if _name_tokens(table, *(c['name'] for c in columns)) & question_tokens
+    }
+    if not matched or matched == set(schema):
+        return None
+
+    # Follow <name>_id foreign-key naming in both directions so joins
+    # against neighbouring tables stay possible
+    names = {t.lower(): t for t in schema}
+    expanded = set(matched)
+    for table, columns in schema.items():
+        for column in columns:
+            col = column['name'].lower()
+            if not col.endswith('_id'):
+                continue
+            target = names.get(col[:-3]) or names.get(col[:-3] + 's')
+            if target is None:
+                continue
+            if table in expanded:
+                expanded.add(target)
+            elif target in expanded:
+                expanded.add(table)
+    return frozenset(expanded)
+
+# System prompts cached per schema snapshot and table subset, so each
+# variant stays byte-identical across requests (prompt-cache friendly)
+_system_prompt_cache = {}
+
+def get_sql_system_prompt(table_subset=None):
+    """System message with the (optionally filtered) schema baked in"""
+    schema_json = backend.get_schema_prompt_json(allow_stale=True)
+    key = (schema_json, table_subset)
+    prompt = _system_prompt_cache.get(key)
+    if prompt is None:
+        if table_subset is None:
+            subset_json = schema_json
+        else:
+            schema = json.loads(schema_json)
+            subset_json = json.dumps(
+                {t: schema[t] for t in sorted(table_subset) if t in schema},
+                indent=2
+            )
+        prompt = (
+            "You are a SQL expert that converts natural language questions "
+            "into SQL queries.\n\n"
+            f"Database schema:\n{subset_json}\n\n"
+            "Return ONLY the SQL query, nothing else. The query must be "
+            f"compatible with {SQL_DIALECT_NAME}."
+        )
+        if len(_system_prompt_cache) > 64:
+            _system_prompt_cache.clear()
+        _system_prompt_cache[key] = prompt
+    return prompt
+
+def build_sql_generation_messages(natural_language):
+    """Build the chat messages used to translate a question into SQL.
+
+    The user message carries only the question; the schema — filtered to
+    the tables the question mentions when possible — lives in the stable
+    system prefix above.
+    """
+    schema = json.loads(backend.get_schema_prompt_json(allow_stale=True))
+    relevant = select_relevant_tables(natural_language, schema)
+    return [
+        {"role": "system", "content": get_sql_system_prompt(relevant)},
+        {"role": "user", "content": f'Convert the following natural language query into a SQL query:\n"{natural_language}"'}
+    ]
+
+async def discard_task(task):
+    """Cancel a background task and wait for it to finish winding down.
+
+    Leaving a cancelled task un-awaited lets the loop close on a pending
+    query and abandons its pooled connection mid-protocol. Safe to call
+    on an already-finished task or None.
+    """
+    if task is None:
+        return
+    task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+    except Exception as e:
+        log.error(f"Error from discarded task: {str(e)}")
+
+def clean_sql_response(sql_query):
+    """Strip markdown code fences from a model-generated SQL string"""
+    sql_query = sql_query.strip()
+    if sql_query.startswith('```sql'):
+        sql_query = sql_query[6:]
+    if sql_query.endswith('```'):
+        sql_query = sql_query[:-3]
+    return sql_query.strip()
+
+# Generate SQL from natural language
+async def generate_sql(natural_language):
+    """Stream SQL generation and start executing before the stream closes.
+
+    Returns (sql_query, execution_task). As soon as the accumulated stream
+    contains a complete statement ending in ';' that passes validation, it
+    is submitted to Neon in a background task so database latency overlaps
+    the last few tokens of the completion. The task is discarded if the
+    final text turns out to differ from the early statement.
+    """
+    try:
+        buffer = ""
+        early_sql = None
+        execution_task = None
+        # Hold the concurrency slot until the stream is fully consumed so
+        # in-flight streamed completions count against OPENAI_MAX_INFLIGHT,
+        # not just their creation
+        async with openai_semaphore:
+            stream = await _chat_completion_request(
+                model="gpt-3.5-turbo",
+                messages=build_sql_generation_messages(natural_language),
+                temperature=0.3,
+                max_tokens=500,
+                stream=True
+            )
+
+            async for chunk in stream:
+                delta = chunk.choices[0].delta.content
+                if not delta:
+                    continue
+                buffer += delta
+                if execution_task is None and ';' in buffer:
+                    candidate = clean_sql_response(buffer[:buffer.index(';') + 1])
+                    # allow_stale: a sync re-inspection here would block the
+                    # event loop mid-stream (and duplicate the concurrent
+                    # refresh task); the post-stream validation in the route
+                    # stays authoritative on the fresh schema
+                    is_valid, _ = validate_sql(candidate, allow_stale=True)
+                    if is_valid:
+                        early_sql = candidate
+                        execution_task = asyncio.create_task(backend.execute(candidate))
+
+        sql_query = clean_sql_response(buffer)
+        if execution_task is not None and early_sql != sql_query:
+            await discard_task(execution_task)
+            execution_task = None
+
+        return sql_query, execution_task
+    except Exception as e:
+        await discard_task(execution_task)
         raise Exception(f"Error generating SQL: {str(e)}")
 
 # API endpoint for processing queries
 @app.route('/query', methods=['POST'])
-def process_query():
+async def process_query():
+    execution_task = None
     try:
-        data = request.json
+        data = await request.get_json()
         natural_language = data.get('query')
-        
+
         if not natural_language:
             return jsonify({"error": "No query provided"}), 400
-        
-        # Generate SQL from natural language
-        sql_query = generate_sql(natural_language)
-        
+
+        # Check the semantic cache before paying for SQL generation
+        embedding, cached = await check_semantic_cache(natural_language)
+        if cached:
+            return jsonify({
+                "success": True,
+                "query": natural_language,
+                "sql": cached['sql_query'],
+                "results": await backend.execute(cached['sql_query']),
+                "summary": cached['summary'],
+                "cached": True
+            })
+
+        # If the schema cache has expired, refresh it concurrently with SQL
+        # generation: the prompt is built from the stale copy and the LLM
+        # call hides the refresh latency entirely
+        refresh_task = None
+        if backend.schema_is_stale():
+            refresh_task = asyncio.create_task(backend.refresh_schema())
+
+        # Generate SQL from natural language (execution may already be in
+        # flight if a complete statement appeared mid-stream)
+        sql_query, execution_task = await generate_sql(natural_language)
+
+        # Validation below prefers the fresh schema, but a failed refresh
+        # shouldn't fail the request: validate_sql already tolerates a
+        # missing schema by skipping the table check
+        if refresh_task is not None:
+            try:
+                await refresh_task
+            except Exception as e:
+                log.error(f"Error refreshing schema: {str(e)}")
+
         # Validate the generated SQL
         is_valid, error_message = validate_sql(sql_query)
         if not is_valid:
+            # An early execution may be in flight for the rejected SQL
+            await discard_task(execution_task)
+            execution_task = None
             return jsonify({
                 "error": f"Invalid SQL query: {error_message}",
                 "generated_sql": sql_query
             }), 400
         
+        # Large result sets can be streamed as NDJSON (one metadata line
+        # with the SQL, then one row per line) so nothing is buffered;
+        # streamed responses skip the summary and the semantic cache
+        if data.get('stream'):
+            await discard_task(execution_task)
+            execution_task = None
+
+            async def generate_rows(sql=sql_query):
+                yield orjson.dumps({"sql": sql}, default=str) + b"\n"
+                # The server-side cursor is synchronous, so pull each row
+                # on a worker thread to keep the event loop free
+                rows = backend.stream(sql)
+                while True:
+                    row = await asyncio.to_thread(next, rows, None)
+                    if row is None:
+                        break
+                    yield orjson.dumps(row, default=str) + b"\n"
+
+            return Response(generate_rows(), mimetype='application/x-ndjson')
+
         # Execute the query
         try:
-            # Execute the query using Neon DB
-            results = execute_query(sql_query)
+            # Execute the query using Neon DB, reusing the early execution
+            # started during streaming when available
+            if execution_task is not None:
+                results = await execution_task
+            else:
+                results = await backend.execute(sql_query)
             
             # Generate natural language summary
-            summary = generate_natural_language_summary(natural_language, results)
-            
+            summary = await generate_natural_language_summary(natural_language, results)
+
+            # Store the answer for future semantically equivalent queries
+            if embedding is not None and backend.name == 'neon':
+                import semantic_cache
+                try:
+                    await asyncio.to_thread(
+                        semantic_cache.store,
+                        embedding, natural_language, sql_query, summary
+                    )
+                except Exception as e:
+                    log.error(f"Error storing in semantic cache: {str(e)}")
+
             return jsonify({
                 "success": True,
                 "query": natural_language,
@@ -174,18 +520,115 @@ def process_query():
                 "generated_sql": sql_query
             }), 400
             
+    except Exception as e:
+        # Don't leak an in-flight early execution on the error path
+        # (harmless no-op if the task was already consumed)
+        await discard_task(execution_task)
+        return jsonify({"error": str(e)}), 500
+
+# Track submitted batches so results can be mapped back to their questions.
+# In-memory is fine for a single worker; batch IDs are also returned to the
+# caller so they survive a restart on the OpenAI side.
+batch_jobs = {}
+
+# Submit many independent queries through the OpenAI Batch API (50% cheaper
+# per token than the online path, 24h completion window). The interactive
+# /query path is unchanged.
+@app.route('/query/batch', methods=['POST'])
+async def submit_batch():
+    try:
+        data = await request.get_json()
+        queries = data.get('queries')
+        if not queries or not isinstance(queries, list):
+            return jsonify({"error": "No queries provided"}), 400
+
+        # One chat-completion request per query, keyed by index
+        lines = []
+        for i, natural_language in enumerate(queries):
+            lines.append(json.dumps({
+                "custom_id": f"query-{i}",
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": {
+                    "model": "gpt-3.5-turbo",
+                    "messages": build_sql_generation_messages(natural_language),
+                    "temperature": 0.3,
+                    "max_tokens": 500
+                }
+            }))
+
+        input_file = await openai_client.files.create(
+            file=('queries.jsonl', '\n'.join(lines).encode()),
+            purpose='batch'
+        )
+        batch = await openai_client.batches.create(
+            input_file_id=input_file.id,
+            endpoint='/v1/chat/completions',
+            completion_window='24h'
+        )
+
+        batch_jobs[batch.id] = {f"query-{i}": q for i, q in enumerate(queries)}
+
+        return jsonify({"batch_id": batch.id, "status": batch.status})
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+# Poll a batch and, once complete, run each generated query through the same
+# validation + execution path as the interactive endpoint
+@app.route('/query/batch/<batch_id>', methods=['GET'])
+async def get_batch(batch_id):
+    try:
+        batch = await openai_client.batches.retrieve(batch_id)
+        if batch.status != 'completed':
+            return jsonify({"batch_id": batch_id, "status": batch.status})
+
+        output = await openai_client.files.content(batch.output_file_id)
+        queries = batch_jobs.get(batch_id, {})
+
+        results = []
+        for line in output.text.splitlines():
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            custom_id = item.get('custom_id')
+            entry = {"query": queries.get(custom_id)}
+            try:
+                content = item['response']['body']['choices'][0]['message']['content']
+                sql_query = clean_sql_response(content)
+                entry["sql"] = sql_query
+
+                is_valid, error_message = validate_sql(sql_query)
+                if not is_valid:
+                    entry["error"] = f"Invalid SQL query: {error_message}"
+                else:
+                    entry["results"] = await backend.execute(sql_query)
+            except Exception as e:
+                entry["error"] = str(e)
+            results.append(entry)
+
+        return jsonify({"batch_id": batch_id, "status": batch.status, "results": results})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 # Serve the frontend
 @app.route('/')
-def index():
-    return render_template('index.html')
+async def index():
+    return await render_template('index.html')
+
+# Admin endpoint to force a schema re-inspection (e.g., after DDL)
+@app.route('/admin/refresh', methods=['POST'])
+def refresh_schema():
+    backend.invalidate_schema_cache()
+    return jsonify({"status": "schema cache invalidated"})
 
 # Health check endpoint
 @app.route('/health', methods=['GET'])
 def health_check():
-    return jsonify({"status": "healthy"})
+    try:
+        tables = backend.check_connection()
+        return jsonify({"status": "healthy", "tables": tables})
+    except Exception as e:
+        return jsonify({"status": "unhealthy", "error": str(e)}), 503
 
 if __name__ == '__main__':
     # Run the app
@@ -0,0 +1,169 @@
+"""Database backends behind a common protocol.
+
+app.py talks to a single Backend object so the Neon and SQLite variants
+share one request path and one validation implementation, selected with
+the BACKEND environment variable.
+"""
+import asyncio
+import json
+import time
+from typing import Protocol
+
+import sql_validation
+
+
+class Backend(Protocol):
+    """What app.py needs from a database backend"""
+
+    name: str
+
+    def get_schema(self) -> dict: ...
+    def get_schema_prompt_json(self, allow_stale: bool = False) -> str: ...
+    def schema_is_stale(self) -> bool: ...
+    async def refresh_schema(self) -> dict: ...
+    def invalidate_schema_cache(self) -> None: ...
+    async def execute(self, query, params=None) -> list: ...
+    def stream(self, query, params=None): ...
+    def validate(self, query, allow_stale: bool = False) -> tuple: ...
+    def check_connection(self) -> list: ...
+
+
+class NeonBackend:
+    """Thin adapter over the neon_db module"""
+
+    name = 'neon'
+
+    def __init__(self):
+        # Imported lazily so selecting the SQLite backend doesn't require
+        # NEON_DB_URL to be configured
+        import neon_db
+        self._db = neon_db
+
+    def get_schema(self):
+        return self._db.get_schema()
+
+    def get_schema_prompt_json(self, allow_stale=False):
+        return self._db.get_schema_prompt_json(allow_stale=allow_stale)
+
+    def schema_is_stale(self):
+        return self._db.schema_is_stale()
+
+    async def refresh_schema(self):
+        return await self._db.refresh_schema_async()
+
+    def invalidate_schema_cache(self):
+        self._db.invalidate_schema_cache()
+
+    async def execute(self, query, params=None):
+        return await self._db.execute_query(query, params)
+
+    def stream(self, query, params=None):
+        return self._db.stream_query(query, params)
+
+    def validate(self, query, allow_stale=False):
+        return self._db.validate_sql(query, allow_stale=allow_stale)
+
+    def check_connection(self):
+        return self._db.check_connection()
+
+
+class SqliteBackend:
+    """Backend over the local SQLite sample database built by init_db.py"""
+
+    name = 'sqlite'
+
+    SCHEMA_CACHE_TTL = 60  # seconds
+
+    def __init__(self, url='sqlite:///ecommerce.db'):
+        from sqlalchemy import create_engine
+        self.engine = create_engine(url)
+        self._schema_cache = None
+        self._schema_prompt_json = None
+        self._schema_cached_at = 0.0
+
+    def _inspect_schema(self):
+        from sqlalchemy import inspect
+        inspector = inspect(self.engine)
+        schema = {}
+        for table_name in inspector.get_table_names():
+            schema[table_name] = [{
+                'name': column['name'],
+                'type': str(column['type']),
+                'nullable': column['nullable'],
+                'primary_key': column.get('primary_key', False)
+            } for column in inspector.get_columns(table_name)]
+        return schema
+
+    def _store_schema(self, schema):
+        self._schema_cache = schema
+        self._schema_prompt_json = json.dumps(schema, indent=2)
+        self._schema_cached_at = time.monotonic()
+
+    def get_schema(self):
+        if self.schema_is_stale():
+            self._store_schema(self._inspect_schema())
+        return self._schema_cache
+
+    def get_schema_prompt_json(self, allow_stale=False):
+        if self._schema_prompt_json is not None and allow_stale:
+            return self._schema_prompt_json
+        self.get_schema()
+        return self._schema_prompt_json
+
+    def schema_is_stale(self):
+        return (self._schema_cache is None
+                or time.monotonic() - self._schema_cached_at > self.SCHEMA_CACHE_TTL)
+
+    async def refresh_schema(self):
+        schema = await asyncio.to_thread(self._inspect_schema)
+        self._store_schema(schema)
+        return schema
+
+    def invalidate_schema_cache(self):
+        self._schema_cache = None
+        self._schema_prompt_json = None
+        self._schema_cached_at = 0.0
+
+    def _execute_sync(self, query, params=None):
+        from sqlalchemy import text
+        with self.engine.connect() as conn:
+            result = conn.execute(text(query), params or {})
+            return [dict(row) for row in result.mappings()]
+
+    async def execute(self, query, params=None):
+        return await asyncio.to_thread(self._execute_sync, query, params)
+
+    def stream(self, query, params=None, chunk_size=1000):
+        from sqlalchemy import text
+        with self.engine.connect() as conn:
+            result = conn.execution_options(stream_results=True).execute(
+                text(query), params or {}
+            )
+            for row in result.yield_per(chunk_size).mappings():
+                yield dict(row)
+
+    def validate(self, query, allow_stale=False):
+        try:
+            if allow_stale and self._schema_cache is not None:
+                schema = self._schema_cache
+            else:
+                schema = self.get_schema()
+            existing_tables = {name.lower() for name in schema}
+        except Exception:
+            existing_tables = None
+        return sql_validation.validate_sql(query, existing_tables, dialect='sqlite')
+
+    def check_connection(self):
+        from sqlalchemy import text
+        with self.engine.connect() as conn:
+            conn.execute(text('SELECT 1'))
+        return list(self.get_schema())
+
+
+def get_backend(name):
+    """Build the backend selected by the BACKEND environment variable"""
+    if name == 'neon':
+        return NeonBackend()
+    if name == 'sqlite':
+        return SqliteBackend()
+    raise ValueError(f"Unknown backend: {name}")
@@ -2,6 +2,9 @@ from sqlalchemy import create_engine, Column, Integer, String, Float, ForeignKey
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
 from datetime import datetime, timedelta
+from logging_setup import get_logger
+
+log = get_logger(__name__)
 
 # Create SQLite database
 engine = create_engine('sqlite:///ecommerce.db')
@@ -40,37 +43,34 @@ class Order(Base):
     customer = relationship('Customer', back_populates='orders')
     product = relationship('Product', back_populates='orders')
 
-def create_sample_data(session):
-    # Create sample customers
+def create_sample_data():
+    # Seed rows as plain dicts: one executemany per table in a single
+    # transaction avoids per-row ORM state tracking and scales to large seeds
     customers = [
-        Customer(name='John Doe', email='john@example.com'),
-        Customer(name='Jane Smith', email='jane@example.com'),
-        Customer(name='Bob Johnson', email='bob@example.com'),
+        {'name': 'John Doe', 'email': 'john@example.com'},
+        {'name': 'Jane Smith', 'email': 'jane@example.com'},
+        {'name': 'Bob Johnson', 'email': 'bob@example.com'},
     ]
-    
-    # Create sample products
+
     products = [
-        Product(name='Laptop', price=1200.00, category='Electronics'),
-        Product(name='Smartphone', price=800.00, category='Electronics'),
-        Product(name='Headphones', price=150.00, category='Accessories'),
-        Product(name='Mouse', price=50.00, category='Accessories'),
+        {'name': 'Laptop', 'price': 1200.00, 'category': 'Electronics'},
+        {'name': 'Smartphone', 'price': 800.00, 'category': 'Electronics'},
+        {'name': 'Headphones', 'price': 150.00, 'category': 'Accessories'},
+        {'name': 'Mouse', 'price': 50.00, 'category': 'Accessories'},
     ]
-    
-    # Add customers and products to session
-    session.add_all(customers + products)
-    session.commit()
-    
-    # Create sample orders
+
     orders = [
-        Order(customer_id=1, product_id=1, quantity=1, order_date=datetime.utcnow() - timedelta(days=5)),
-        Order(customer_id=1, product_id=3, quantity=2, order_date=datetime.utcnow() - timedelta(days=3)),
-        Order(customer_id=2, product_id=2, quantity=1, order_date=datetime.utcnow() - timedelta(days=2)),
-        Order(customer_id=3, product_id=4, quantity=3, order_date=datetime.utcnow() - timedelta(days=1)),
-        Order(customer_id=2, product_id=1, quantity=1, order_date=datetime.utcnow()),
+        {'customer_id': 1, 'product_id': 1, 'quantity': 1, 'order_date': datetime.utcnow() - timedelta(days=5)},
+        {'customer_id': 1, 'product_id': 3, 'quantity': 2, 'order_date': datetime.utcnow() - timedelta(days=3)},
+        {'customer_id': 2, 'product_id': 2, 'quantity': 1, 'order_date': datetime.utcnow() - timedelta(days=2)},
+        {'customer_id': 3, 'product_id': 4, 'quantity': 3, 'order_date': datetime.utcnow() - timedelta(days=1)},
+        {'customer_id': 2, 'product_id': 1, 'quantity': 1, 'order_date': datetime.utcnow()},
     ]
-    
-    session.add_all(orders)
-    session.commit()
+
+    with engine.begin() as conn:
+        conn.execute(Customer.__table__.insert(), customers)
+        conn.execute(Product.__table__.insert(), products)
+        conn.execute(Order.__table__.insert(), orders)
 
 def init_db():
     # Create all tables
@@ -83,12 +83,12 @@ def init_db():
     try:
         # Check if we already have data
         if not session.query(Customer).first():
-            create_sample_data(session)
-            print("Database initialized with sample data!")
+            create_sample_data()
+            log.info("Database initialized with sample data!")
         else:
-            print("Database already contains data.")
+            log.info("Database already contains data.")
     except Exception as e:
-        print(f"Error initializing database: {e}")
+        log.error(f"Error initializing database: {e}")
         session.rollback()
     finally:
         session.close()
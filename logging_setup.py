@@ -0,0 +1,28 @@
+"""Non-blocking logging shared by every module.
+
+Records are pushed onto an in-memory queue and written to stderr by a
+dedicated listener thread, so request threads never stall behind a slow
+or backed-up output pipe.
+"""
+import logging
+import queue
+from logging.handlers import QueueHandler, QueueListener
+
+_listener = None
+
+
+def get_logger(name):
+    """Module logger wired to the queue-based root handler (set up once)"""
+    global _listener
+    if _listener is None:
+        log_queue = queue.SimpleQueue()
+        handler = logging.StreamHandler()
+        handler.setFormatter(
+            logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s')
+        )
+        root = logging.getLogger()
+        root.setLevel(logging.INFO)
+        root.addHandler(QueueHandler(log_queue))
+        _listener = QueueListener(log_queue, handler)
+        _listener.start()
+    return logging.getLogger(name)
@@ -1,103 +1,224 @@
 from sqlalchemy import create_engine, inspect, text
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
+import asyncpg
+
+import sql_validation
+import asyncio
 import os
+import json
+import time
+from functools import lru_cache
 from dotenv import load_dotenv
+from logging_setup import get_logger
+
+log = get_logger(__name__)
 
 load_dotenv()
 
 # Neon connection URL from environment variable
 NEON_DB_URL = os.getenv('NEON_DB_URL')
 
-# Create engine with pool settings optimized for serverless
-engine = create_engine(
-    NEON_DB_URL,
-    pool_pre_ping=True,
-    pool_size=5,
-    max_overflow=10,
-    pool_recycle=300  # Recycle connections after 5 minutes
-)
+# The sync engine only serves schema inspection, streaming and the semantic
+# cache. On serverless Neon, pooled connections are killed by scale-to-zero
+# and pool_pre_ping costs one SELECT 1 round-trip per checkout, so use
+# NullPool and let the driver open a fresh connection per use instead
+engine = create_engine(NEON_DB_URL, poolclass=NullPool)
 
 Session = sessionmaker(bind=engine)
 
+# asyncpg wants a plain postgres:// DSN without the SQLAlchemy driver suffix
+_ASYNCPG_DSN = NEON_DB_URL.replace('postgresql+psycopg2://', 'postgresql://') if NEON_DB_URL else NEON_DB_URL
+
+# Async connection pool for query execution, created lazily on first use.
+# The pool is bound to the loop that created it, so remember that loop and
+# rebuild if a different one shows up (e.g., tests running under
+# asyncio.run, or a server that recreates its loop)
+_pool = None
+_pool_loop = None
+
+async def _get_pool():
+    global _pool, _pool_loop
+    loop = asyncio.get_running_loop()
+    if _pool is not None and _pool_loop is not loop:
+        # Connections on the old (likely closed) loop are unusable; drop
+        # them without a graceful close, which would need that loop
+        try:
+            _pool.terminate()
+        except Exception:
+            pass
+        _pool = None
+    if _pool is None:
+        _pool_loop = loop
+        _pool = await asyncpg.create_pool(
+            _ASYNCPG_DSN,
+            min_size=1,
+            max_size=20,
+            statement_cache_size=1024,
+            max_inactive_connection_lifetime=60,
+            server_settings={'jit': 'off'}
+        )
+    return _pool
+
+@lru_cache(maxsize=1)
 def check_connection():
-    """Check database connection and log available tables"""
+    """Check database connection and return available tables.
+
+    Called lazily from the health endpoint rather than at import, so
+    worker startup doesn't pay a Neon round-trip per process. Cached so
+    repeated health pings don't hit the database.
+    """
     try:
         with engine.connect() as conn:
             # Test the connection
             conn.execute(text('SELECT 1'))
-            
+
             # Get table names
             inspector = inspect(engine)
             tables = inspector.get_table_names(schema='public')
-            print(f"Successfully connected to database. Available tables: {', '.join(tables) or 'No tables found'}")
-            
-            # Print table schemas for debugging
-            for table in tables:
-                print(f"\nTable: {table}")
-                for column in inspector.get_columns(table, schema='public'):
-                    print(f"  {column['name']}: {column['type']}")
-                    
+            log.info(f"Successfully connected to database. Available tables: {', '.join(tables) or 'No tables found'}")
+            return tables
+
     except Exception as e:
-        print(f"Error connecting to database: {e}")
+        log.error(f"Error connecting to database: {e}")
         raise
 
-# Check connection when module is imported
-check_connection()
+# In-process schema cache: inspecting the catalog costs several round-trips
+# to Neon, so reuse the result for a short TTL instead of per request
+SCHEMA_CACHE_TTL = 60  # seconds
+_schema_cache = None
+_schema_prompt_json = None
+_schema_cached_at = 0.0
+
+# One catalog query instead of the inspector's per-table round-trips:
+# every column plus its primary-key flag in a single result set
+_SCHEMA_SQL = """
+    SELECT c.table_name, c.column_name, c.data_type, c.is_nullable,
+           COALESCE(pk.is_pk, false) AS is_pk
+    FROM information_schema.columns c
+    LEFT JOIN (
+        SELECT kcu.table_name, kcu.column_name, true AS is_pk
+        FROM information_schema.table_constraints tc
+        JOIN information_schema.key_column_usage kcu
+          ON tc.constraint_name = kcu.constraint_name
+         AND tc.table_schema = kcu.table_schema
+        WHERE tc.constraint_type = 'PRIMARY KEY' AND tc.table_schema = 'public'
+    ) pk ON pk.table_name = c.table_name AND pk.column_name = c.column_name
+    WHERE c.table_schema = 'public'
+    ORDER BY c.table_name, c.ordinal_position
+"""
 
-def get_schema():
-    """Get schema information from Neon database"""
-    inspector = inspect(engine)
+def _rows_to_schema(rows):
+    """Build the schema dict from _SCHEMA_SQL result rows"""
     schema = {}
-    
-    for table_name in inspector.get_table_names(schema='public'):
-        columns = []
-        for column in inspector.get_columns(table_name, schema='public'):
-            columns.append({
-                'name': column['name'],
-                'type': str(column['type']),
-                'nullable': column['nullable'],
-                'primary_key': column.get('primary_key', False)
-            })
-        schema[table_name] = columns
-    
+    for row in rows:
+        schema.setdefault(row['table_name'], []).append({
+            'name': row['column_name'],
+            'type': row['data_type'],
+            'nullable': row['is_nullable'] in ('YES', True),
+            'primary_key': bool(row['is_pk'])
+        })
     return schema
 
-def execute_query(query, params=None):
-    """Execute a read-only query on Neon database"""
+def _store_schema(schema):
+    global _schema_cache, _schema_prompt_json, _schema_cached_at
+    _schema_cache = schema
+    _schema_prompt_json = json.dumps(_schema_cache, indent=2)
+    _schema_cached_at = time.monotonic()
+
+def schema_is_stale():
+    """Whether the cached schema is missing or past its TTL"""
+    return _schema_cache is None or time.monotonic() - _schema_cached_at > SCHEMA_CACHE_TTL
+
+def _inspect_schema():
+    """Read schema information from the Neon catalog in one round-trip"""
+    with engine.connect() as conn:
+        rows = conn.execute(text(_SCHEMA_SQL)).mappings().all()
+    return _rows_to_schema(rows)
+
+def get_schema(allow_stale=False):
+    """Get schema information, cached in memory with a short TTL.
+
+    With allow_stale=True an expired copy is returned rather than blocking
+    on a re-inspection, for callers that refresh concurrently.
+    """
+    if _schema_cache is not None and allow_stale:
+        return _schema_cache
+    if schema_is_stale():
+        _store_schema(_inspect_schema())
+    return _schema_cache
+
+async def refresh_schema_async():
+    """Refresh the schema cache on the async pool without blocking the loop"""
+    pool = await _get_pool()
+    async with pool.acquire() as conn:
+        _store_schema(_rows_to_schema(await conn.fetch(_SCHEMA_SQL)))
+    return _schema_cache
+
+def get_schema_prompt_json(allow_stale=False):
+    """JSON-encoded schema for LLM prompts, serialized once per cache refresh.
+
+    With allow_stale=True an expired copy is returned rather than blocking
+    on a re-inspection, for callers that refresh concurrently.
+    """
+    if _schema_prompt_json is not None and allow_stale:
+        return _schema_prompt_json
+    get_schema()
+    return _schema_prompt_json
+
+def invalidate_schema_cache():
+    """Force the next get_schema() call to re-inspect the database"""
+    global _schema_cache, _schema_prompt_json, _schema_cached_at
+    _schema_cache = None
+    _schema_prompt_json = None
+    _schema_cached_at = 0.0
+
+def stream_query(query, params=None, chunk_size=1000):
+    """Stream a read-only query as row dicts without materializing results.
+
+    Uses a server-side cursor (stream_results) fetching chunk_size rows at
+    a time, so memory stays constant regardless of result-set size.
+    """
     with engine.connect() as conn:
-        result = conn.execute(text(query), params or {})
-        
-        # Convert rows to dictionaries, handling special types
-        rows = []
-        for row in result.mappings():
-            row_dict = {}
-            for key, value in row.items():
-                # Convert UUID to string
-                if hasattr(value, 'hex'):
-                    value = str(value)
-                # Handle other non-serializable types here if needed
-                row_dict[key] = value
-            rows.append(row_dict)
-            
-        return rows
-
-def validate_sql(query):
-    """Basic SQL validation for Neon database"""
-    # Basic validation to prevent SQL injection
-    forbidden_keywords = ['DROP', 'DELETE', 'UPDATE', 'INSERT', 'ALTER', 'TRUNCATE', 'GRANT', 'REVOKE']
-    query_upper = query.upper()
-    
-    # Check for forbidden keywords
-    for keyword in forbidden_keywords:
-        if f' {keyword} ' in f' {query_upper} ':
-            return False, f"Query contains forbidden keyword: {keyword}"
-    
-    # Check if it's a SELECT query (we only allow read operations)
-    if not query_upper.lstrip().upper().startswith('SELECT'):
-        return False, "Only SELECT queries are allowed"
-    
-    # Skip table existence check for now to allow more flexible queries
-    # This is a trade-off between security and usability
-    # In production, you might want to implement a more robust whitelist
-    
-    return True, ""
+        result = conn.execution_options(stream_results=True).execute(
+            text(query), params or {}
+        )
+        for row in result.yield_per(chunk_size).mappings():
+            yield dict(row)
+
+async def execute_query(query, params=None):
+    """Execute a read-only query on Neon database"""
+    pool = await _get_pool()
+    # Neon's scale-to-zero can kill a pooled connection between requests;
+    # retry once so the pool replaces the dead connection transparently
+    for attempt in (0, 1):
+        try:
+            async with pool.acquire() as conn:
+                # Piggyback a catalog refresh on the connection we already
+                # hold when the schema cache has expired, saving a separate
+                # round-trip
+                if schema_is_stale():
+                    _store_schema(_rows_to_schema(await conn.fetch(_SCHEMA_SQL)))
+                rows = await conn.fetch(query, *(params or ()))
+
+            # asyncpg returns native Python types; non-JSON types like UUID
+            # are handled at serialization time
+            return [dict(row) for row in rows]
+        except (asyncpg.ConnectionDoesNotExistError, asyncpg.InterfaceError):
+            if attempt:
+                raise
+
+def validate_sql(query, allow_stale=False):
+    """Validate generated SQL against the cached Neon schema.
+
+    Skips the table check if the schema can't be fetched so validation
+    doesn't fail on a transient catalog error. allow_stale=True checks
+    against an expired cached schema instead of re-inspecting, for
+    non-authoritative callers like the mid-stream early check.
+    """
+    try:
+        existing_tables = {name.lower() for name in get_schema(allow_stale=allow_stale)}
+    except Exception:
+        existing_tables = None
+
+    return sql_validation.validate_sql(query, existing_tables, dialect='postgres')
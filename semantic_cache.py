@@ -0,0 +1,100 @@
+from sqlalchemy import text
+import hashlib
+import json
+
+from neon_db import engine, get_schema
+
+# Embedding model used for cache keys (must match the dimension below)
+EMBEDDING_MODEL = 'text-embedding-3-small'
+EMBEDDING_DIM = 1536
+
+# Similarity thresholds for the dual-threshold policy:
+# hits at or above HIGH are returned directly, hits between LOW and HIGH
+# need an LLM equivalence check before being trusted
+HIGH_CONFIDENCE = 0.92
+LOW_CONFIDENCE = 0.85
+
+# Cached entries older than this are ignored
+CACHE_TTL = '1 hour'
+
+_table_ready = False
+
+
+def _schema_hash():
+    """Hash of the current schema, used to namespace cache entries"""
+    schema = get_schema()
+    return hashlib.sha1(json.dumps(schema, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def _ensure_table():
+    """Create the pgvector extension and cache table on first use"""
+    global _table_ready
+    if _table_ready:
+        return
+    with engine.begin() as conn:
+        conn.execute(text('CREATE EXTENSION IF NOT EXISTS vector'))
+        conn.execute(text(f"""
+            CREATE TABLE IF NOT EXISTS query_cache (
+                id SERIAL PRIMARY KEY,
+                embedding vector({EMBEDDING_DIM}) NOT NULL,
+                nl_query TEXT NOT NULL,
+                sql_query TEXT NOT NULL,
+                summary TEXT,
+                schema_hash TEXT NOT NULL,
+                created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+            )
+        """))
+        # Without an ANN index the <=> lookup sequential-scans the whole
+        # cache; hnsw needs no training step so it works from row one
+        conn.execute(text("""
+            CREATE INDEX IF NOT EXISTS query_cache_embedding_idx
+            ON query_cache USING hnsw (embedding vector_cosine_ops)
+        """))
+    _table_ready = True
+
+
+def _to_vector_literal(embedding):
+    return '[' + ','.join(str(x) for x in embedding) + ']'
+
+
+def lookup(embedding):
+    """Find the nearest cached query for an embedding.
+
+    Returns a dict with nl_query, sql_query, summary and similarity for the
+    closest entry above LOW_CONFIDENCE, or None. The caller decides whether
+    the hit is trustworthy based on the similarity (dual-threshold policy).
+    """
+    _ensure_table()
+    with engine.connect() as conn:
+        row = conn.execute(text(f"""
+            SELECT nl_query, sql_query, summary,
+                   1 - (embedding <=> CAST(:emb AS vector)) AS similarity
+            FROM query_cache
+            WHERE schema_hash = :schema_hash
+              AND created_at > now() - interval '{CACHE_TTL}'
+            ORDER BY embedding <=> CAST(:emb AS vector)
+            LIMIT 1
+        """), {
+            'emb': _to_vector_literal(embedding),
+            'schema_hash': _schema_hash()
+        }).mappings().first()
+
+    if row is None or row['similarity'] < LOW_CONFIDENCE:
+        return None
+    return dict(row)
+
+
+def store(embedding, nl_query, sql_query, summary):
+    """Store a successfully answered query in the cache"""
+    _ensure_table()
+    with engine.begin() as conn:
+        conn.execute(text("""
+            INSERT INTO query_cache (embedding, nl_query, sql_query, summary, schema_hash)
+            VALUES (CAST(:emb AS vector), :nl_query, :sql_query, :summary, :schema_hash)
+        """), {
+            'emb': _to_vector_literal(embedding),
+            'nl_query': nl_query,
+            'sql_query': sql_query,
+            'summary': summary,
+            'schema_hash': _schema_hash()
+        })
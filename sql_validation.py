@@ -0,0 +1,78 @@
+"""SQL validation shared by every database backend.
+
+Keeping a single implementation here prevents the validation rules from
+drifting between backends.
+"""
+import re
+
+import sqlglot
+from sqlglot import exp
+
+# Pre-compiled screens used before the full parse: a valid query must start
+# with SELECT or WITH, and a forbidden statement can only exist in the AST
+# if its keyword appears lexically somewhere in the text
+_SELECT_RE = re.compile(r'^\s*(SELECT|WITH)\b', re.I)
+_FORBIDDEN_RE = re.compile(
+    r'\b(DROP|DELETE|UPDATE|INSERT|ALTER|TRUNCATE|GRANT|REVOKE|CREATE)\b', re.I
+)
+
+# Statement types that must never appear anywhere in a generated query.
+# Built with getattr so the list survives sqlglot renames across versions.
+_FORBIDDEN_NODES = tuple(
+    node for node in (
+        getattr(exp, name, None)
+        for name in ('Insert', 'Update', 'Delete', 'Drop', 'Create',
+                     'Alter', 'AlterTable', 'TruncateTable', 'Grant', 'Command')
+    ) if node is not None
+)
+
+
+def validate_sql(query, existing_tables=None, dialect='postgres'):
+    """Validate generated SQL by parsing it instead of scanning substrings.
+
+    Substring checks are trivially bypassed (comments, string literals);
+    parsing the query once lets us reject anything that isn't a plain
+    SELECT and any reference to tables that don't exist in the schema.
+
+    existing_tables is a set of lowercase table names to allow, or None to
+    skip the table check (e.g., when the schema can't be fetched).
+    """
+    # Cheap reject before parsing: anything that doesn't start with
+    # SELECT or WITH can never pass the checks below
+    if not _SELECT_RE.match(query):
+        return False, "Only SELECT queries are allowed"
+
+    try:
+        statements = [s for s in sqlglot.parse(query, read=dialect) if s is not None]
+    except sqlglot.errors.ParseError as e:
+        return False, f"Could not parse SQL: {e}"
+
+    # parse_one would silently drop everything after the first ';', letting
+    # 'SELECT 1; DROP TABLE t' through, so parse all statements and insist
+    # on exactly one
+    if len(statements) != 1:
+        return False, "Only a single SELECT statement is allowed"
+    tree = statements[0]
+
+    # Only read operations are allowed; exp.Union also covers EXCEPT and
+    # INTERSECT, and the walks below traverse both sides of the operation
+    if not isinstance(tree, (exp.Select, exp.Union)):
+        return False, "Only SELECT queries are allowed"
+
+    # Walk the AST for forbidden statements only when one of their
+    # keywords actually appears in the text
+    if _FORBIDDEN_RE.search(query):
+        forbidden = tree.find(*_FORBIDDEN_NODES)
+        if forbidden is not None:
+            return False, f"Query contains forbidden statement: {forbidden.key.upper()}"
+
+    # Check referenced tables against the schema; CTE names defined in the
+    # query itself are allowed
+    if existing_tables is not None:
+        cte_names = {cte.alias_or_name.lower() for cte in tree.find_all(exp.CTE)}
+        for table in tree.find_all(exp.Table):
+            name = table.name.lower()
+            if name and name not in existing_tables and name not in cte_names:
+                return False, f"Query references unknown table: {table.name}"
+
+    return True, ""